@@ -8,6 +8,12 @@ def jwt_required(f):
 
     @wraps(f)
     async def decorated_function(*args, **kwargs):
+        # Set only by server code, e.g. /batch after it verified the token once
+        verified_username = getattr(request, 'verified_username', None)
+        if verified_username:
+            g.username = verified_username
+            return await f(*args, **kwargs)
+
         token = None
         if 'Authorization' in request.headers:
             try:
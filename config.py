@@ -10,6 +10,27 @@ class Config:
         'JWT_SECRET_KEY') or secrets.token_urlsafe(32)
     JWT_EXPIRATION_DELTA = datetime.timedelta(hours=24)
 
+    # Country calling code assumed for numbers saved without a '+' prefix
+    DEFAULT_COUNTRY_CODE = os.environ.get('DEFAULT_COUNTRY_CODE', '91')
+    PHONE_LOOKUP_MAX_NUMBERS = 100
+    SINGLE_FLIGHT_METRICS_MAX_KEYS = 1024
+    METRICS_LOG_INTERVAL_SECONDS = int(
+        os.environ.get('METRICS_LOG_INTERVAL_SECONDS', 300))
+    BATCH_MAX_REQUESTS = 20
+
+    # Username Bloom filter sizing; memory never exceeds the byte cap
+    USERNAME_FILTER_MIN_CAPACITY = 100_000
+    USERNAME_FILTER_FP_RATE = 0.01
+    USERNAME_FILTER_MAX_BYTES = 16 * 1024 * 1024
+    # Each process only sees its own signups between syncs, so names taken
+    # through other workers can read as available for up to this long.
+    # Set to 0 to skip syncing when a single process serves the app.
+    USERNAME_FILTER_SYNC_SECONDS = int(
+        os.environ.get('USERNAME_FILTER_SYNC_SECONDS', 5))
+    # Syncs re-read accounts this far behind the newest one seen, because
+    # ObjectIds from different workers are neither ordered nor clock-synced.
+    USERNAME_FILTER_SYNC_OVERLAP_SECONDS = 60
+
     DB_USER = parser.quote_plus(os.environ.get('DB_USER', 'Rajat'))
     DB_PASSWORD = parser.quote_plus(os.environ.get('DB_PASSWORD', '2844'))
     DB_CLUSTER = os.environ.get('DB_CLUSTER', 'cluster0.gpq2duh')
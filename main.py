@@ -1,8 +1,18 @@
+import asyncio
 from quart import Quart
 from quart_cors import cors
 from config import config
 from routes import api as api_blueprint
-from database import helplines_collection
+from database import helplines_collection, user_contacts_collection, accounts_collection
+import services as srv
+
+
+def log_username_filter_stats():
+    stats = srv.get_username_filter_stats()
+    if stats:
+        print(f"Username filter: {stats['items']} names, "
+              f"{stats['memory_bytes'] / 1024 / 1024:.1f} MiB, "
+              f"~{stats['estimated_fp_rate']:.2%} false positives.")
 
 
 def create_app():
@@ -43,6 +53,73 @@ def create_app():
         except Exception as e:
             print(f"Error during database initialization: {e}")
 
+    # Runs in the background: until it finishes, lookups only miss old contacts.
+    async def initialize_phone_index():
+        try:
+            await user_contacts_collection.create_index(
+                [("Username", 1), ("Contacts.NormalizedContact", 1)])
+            updated = await srv.backfill_normalized_contacts_async()
+            if updated:
+                print(f"Backfilled normalized numbers for {updated} contact books.")
+        except Exception as e:
+            print(f"Error creating phone lookup index: {e}")
+
+    @app.before_serving
+    async def initialize_username_filter():
+        try:
+            await accounts_collection.create_index([("Username", 1)], unique=True)
+        except Exception as e:
+            print(f"Error creating username index: {e}")
+        await srv.load_username_filter_async()
+        log_username_filter_stats()
+
+    # Periodic jobs, started once the app is serving
+    background_tasks = []
+
+    async def report_single_flight_metrics():
+        while True:
+            await asyncio.sleep(config.METRICS_LOG_INTERVAL_SECONDS)
+            metrics = srv.get_single_flight_metrics()
+            if not metrics:
+                continue
+            # Grouped by operation so usernames never reach the logs
+            by_operation = {}
+            for key, stats in metrics.items():
+                totals = by_operation.setdefault(key.split(':', 1)[0], dict.fromkeys(stats, 0))
+                for field, value in stats.items():
+                    totals[field] += value
+            print("Single-flight: " + "; ".join(
+                f"{operation} {t['calls']} calls, {t['executions']} queries, "
+                f"{t['shared']} shared, {t['invalidated']} invalidated"
+                for operation, t in sorted(by_operation.items())))
+
+    async def report_username_filter_stats():
+        while True:
+            await asyncio.sleep(config.METRICS_LOG_INTERVAL_SECONDS)
+            log_username_filter_stats()
+
+    async def sync_username_filter():
+        while True:
+            await asyncio.sleep(config.USERNAME_FILTER_SYNC_SECONDS)
+            await srv.sync_username_filter_async()
+
+    @app.before_serving
+    async def start_background_tasks():
+        background_tasks.append(asyncio.create_task(
+            initialize_phone_index()))
+        background_tasks.append(asyncio.create_task(
+            report_single_flight_metrics()))
+        background_tasks.append(asyncio.create_task(
+            report_username_filter_stats()))
+        if config.USERNAME_FILTER_SYNC_SECONDS > 0:
+            background_tasks.append(asyncio.create_task(
+                sync_username_filter()))
+
+    @app.after_serving
+    async def stop_background_tasks():
+        for task in background_tasks:
+            task.cancel()
+
     return app
 
 
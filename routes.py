@@ -1,4 +1,6 @@
-from quart import Blueprint, request, jsonify, g, Response
+from quart import Blueprint, request, jsonify, g, Response, current_app
+from werkzeug.exceptions import HTTPException
+import asyncio
 import datetime
 import jwt
 import json
@@ -9,17 +11,58 @@ import services as srv
 api = Blueprint('api', __name__, url_prefix='/api/v2')
 
 
+def serialize_contact(contact):
+    # Returns a new dict: service results may be shared between requests.
+    return {**contact, '_id': str(contact['_id'])} if '_id' in contact else contact
+
+
 def serialize_contacts(contacts):
-    for contact in contacts:
-        if '_id' in contact:
-            contact['_id'] = str(contact['_id'])
-    return contacts
+    return [serialize_contact(contact) for contact in contacts]
 
 
 @api.route('/')
 async def index():
     return jsonify({"message": "Welcome to the Contacts API!"})
 
+
+def is_read_request(item):
+    return not isinstance(item, dict) or str(item.get('method', 'GET')).upper() in ('GET', 'HEAD')
+
+
+async def run_sub_request(username, item):
+    """Dispatch one /batch item to its api handler as an already verified user."""
+    if not isinstance(item, dict) or not item.get('path'):
+        return {"id": None, "status": 400, "body": {"error": "Each request needs a 'path'"}}
+    item_id, method = item.get('id'), str(item.get('method', 'GET')).upper()
+    path, _, query_string = str(item['path']).partition('?')
+    if not path.startswith(api.url_prefix):
+        path = api.url_prefix + path
+
+    try:
+        adapter = current_app.url_map.bind('localhost')
+        rule, view_args = adapter.match(path, method, return_rule=True)
+    except HTTPException as e:
+        return {"id": item_id, "status": e.code, "body": {"error": e.description}}
+    if not rule.endpoint.startswith(f"{api.name}.") or rule.endpoint == f"{api.name}.api_batch":
+        return {"id": item_id, "status": 400, "body": {"error": f"'{path}' cannot be batched"}}
+
+    view = current_app.view_functions[rule.endpoint]
+    context_kwargs = {"json": item['body']} if 'body' in item else {}
+    try:
+        # Quart splits the query off the path itself, keeping repeated keys.
+        async with current_app.test_request_context(
+                f"{path}?{query_string}" if query_string else path, method=method, **context_kwargs):
+            request.verified_username = username
+            response = await current_app.make_response(await view(**view_args))
+            body = await response.get_json()
+            if body is None:
+                body = await response.get_data(as_text=True)
+            return {"id": item_id, "status": response.status_code, "body": body}
+    except HTTPException as e:
+        return {"id": item_id, "status": e.code, "body": {"error": e.description}}
+    except Exception as e:
+        return {"id": item_id, "status": 500, "body": {"error": f"An internal server error occurred: {e}"}}
+
 # --- Auth Routes ---
 
 
@@ -32,7 +75,7 @@ async def api_register():
 
         if not all([name, username, password]):
             return jsonify({"error": "Missing required fields"}), 400
-        if await srv.check_user_async(username):
+        if await srv.check_user_async(username, authoritative=True):
             return jsonify({"error": "Username already exists."}), 409
 
         success, message = await srv.create_user_async(image, name, username, password, mobile)
@@ -144,8 +187,7 @@ async def api_edit_contact(contact_id):
     if request.method == 'GET':
         contact = await srv.get_contact_by_id_async(g.username, contact_id)
         if contact:
-            contact['_id'] = str(contact['_id'])
-            return jsonify({"success": True, "contact": contact}), 200
+            return jsonify({"success": True, "contact": serialize_contact(contact)}), 200
         return jsonify({"error": "Contact not found"}), 404
 
     if request.method == 'PUT':
@@ -167,8 +209,7 @@ async def api_edit_contact(contact_id):
 async def api_get_contact(contact_id):
     contact = await srv.get_contact_by_id_async(g.username, contact_id)
     if contact:
-        contact['_id'] = str(contact['_id'])
-        return jsonify({"success": True, "contact": contact}), 200
+        return jsonify({"success": True, "contact": serialize_contact(contact)}), 200
     return jsonify({"error": "Contact not found"}), 404
 
 
@@ -200,6 +241,26 @@ async def api_search_contacts():
     return jsonify({"success": True, "contacts": serialize_contacts(results)}), 200
 
 
+@api.route('/contacts/lookup', methods=['GET', 'POST'])
+@jwt_required
+async def api_lookup_contacts():
+    if request.method == 'POST':
+        data = await request.get_json()
+        phones = data.get('phones') if data else None
+    else:
+        phones = [p for value in request.args.getlist(
+            'phone') for p in value.split(',') if p.strip()]
+    if not phones or not isinstance(phones, list):
+        return jsonify({"error": "Missing phone number(s) to look up"}), 400
+    if len(phones) > config.PHONE_LOOKUP_MAX_NUMBERS:
+        return jsonify({"error": f"At most {config.PHONE_LOOKUP_MAX_NUMBERS} numbers can be looked up at once"}), 400
+
+    results = await srv.lookup_contacts_by_phone_async(g.username, [str(p) for p in phones])
+    for result in results.values():
+        result["contacts"] = serialize_contacts(result["contacts"])
+    return jsonify({"success": True, "results": results}), 200
+
+
 @api.route('/contacts/export', methods=['GET'])
 @jwt_required
 async def api_export_contacts():
@@ -210,6 +271,32 @@ async def api_export_contacts():
         headers={'Content-Disposition': 'attachment;filename=contacts.json'}
     )
 
+# --- Batch Routes ---
+
+
+@api.route('/batch', methods=['POST'])
+@jwt_required
+async def api_batch():
+    data = await request.get_json()
+    sub_requests = data.get('requests') if data else None
+    if not sub_requests or not isinstance(sub_requests, list):
+        return jsonify({"error": "Missing 'requests' list"}), 400
+    if len(sub_requests) > config.BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"At most {config.BATCH_MAX_REQUESTS} requests can be batched at once"}), 400
+
+    # Runs of consecutive reads go concurrently; each write runs alone, in order,
+    # so later items see earlier writes. 'sequential' runs every item alone.
+    responses, reads = [], []
+    for item in sub_requests:
+        if not data.get('sequential') and is_read_request(item):
+            reads.append(item)
+            continue
+        responses += await asyncio.gather(*(run_sub_request(g.username, r) for r in reads))
+        reads = []
+        responses.append(await run_sub_request(g.username, item))
+    responses += await asyncio.gather(*(run_sub_request(g.username, r) for r in reads))
+    return jsonify({"success": True, "responses": responses}), 200
+
 # --- Trash Routes ---
 
 
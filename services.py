@@ -1,6 +1,14 @@
 from bson.objectid import ObjectId
+from collections import OrderedDict
+from pymongo import UpdateOne
+import asyncio
 import bcrypt
 import datetime
+import functools
+import hashlib
+import math
+import re
+from config import config
 from database import (
     accounts_collection,
     user_contacts_collection,
@@ -8,10 +16,215 @@ from database import (
     trash_collection
 )
 
+# --- Phone Helpers ---
+
+
+def normalize_phone(number: str):
+    """Normalize a stored or dialed number to E.164 ('+<country><number>')."""
+    if not number:
+        return None
+    raw = str(number).strip()
+    digits = re.sub(r"\D", "", raw)
+    if not digits:
+        return None
+    international = raw.startswith('+')
+    if not international and digits.startswith('00'):
+        international, digits = True, digits[2:]
+    elif not international:
+        digits = digits.lstrip('0')
+    # Country codes never start with 0; three digits is the shortest service number.
+    if len(digits) < 3 or (international and digits.startswith('0')):
+        return None
+    if not international and len(digits) <= 10:
+        digits = config.DEFAULT_COUNTRY_CODE + digits
+    if len(digits) > 15:
+        return None
+    return f"+{digits}"
+
+
+# --- Single-Flight Reads ---
+
+
+class SingleFlight:
+    """Runs concurrent identical reads once and shares the awaited result."""
+
+    def __init__(self, max_metric_keys: int):
+        self._in_flight = {}
+        self._metrics = OrderedDict()
+        self._max_metric_keys = max_metric_keys
+
+    def _stats(self, key):
+        stats = self._metrics.pop(key, None) or {
+            "calls": 0, "executions": 0, "shared": 0, "invalidated": 0}
+        self._metrics[key] = stats
+        while len(self._metrics) > self._max_metric_keys:
+            self._metrics.popitem(last=False)
+        return stats
+
+    async def do(self, key, fn, *args, **kwargs):
+        stats = self._stats(key)
+        stats["calls"] += 1
+        task = self._in_flight.get(key)
+        if task is not None:
+            stats["shared"] += 1
+        else:
+            stats["executions"] += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # The result object is shared between callers and must be treated as read-only.
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def invalidate(self, username: str):
+        for key in [k for k in self._in_flight if k[1] == username]:
+            del self._in_flight[key]
+            self._stats(key)["invalidated"] += 1
+
+    def metrics(self):
+        return {":".join(map(str, key)): dict(stats) for key, stats in self._metrics.items()}
+
+
+single_flight = SingleFlight(config.SINGLE_FLIGHT_METRICS_MAX_KEYS)
+
+
+def coalesced(fn):
+    @functools.wraps(fn)
+    async def wrapper(username, *args, **kwargs):
+        key = (fn.__name__, username, *args, *sorted(kwargs.items()))
+        return await single_flight.do(key, fn, username, *args, **kwargs)
+    return wrapper
+
+
+def invalidates_reads(fn):
+    @functools.wraps(fn)
+    async def wrapper(username, *args, **kwargs):
+        try:
+            return await fn(username, *args, **kwargs)
+        finally:
+            single_flight.invalidate(username)
+    return wrapper
+
+
+def get_single_flight_metrics():
+    return single_flight.metrics()
+
+
+# --- Username Filter ---
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; a miss means the item was never added."""
+
+    def __init__(self, num_bits: int, num_hashes: int, capacity: int):
+        self.num_bits = num_bits
+        self.capacity = capacity
+        self.num_hashes = num_hashes
+        self.count = 0
+        self._bits = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float, max_bytes: int):
+        num_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        num_bits = max(8, min(num_bits, max_bytes * 8))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes, capacity)
+
+    def _positions(self, item):
+        # Routes pass raw JSON values through, so non-strings are hashed by str().
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def stats(self):
+        fill = 1 - math.exp(-self.num_hashes * self.count / self.num_bits)
+        return {
+            "items": self.count, "bits": self.num_bits, "hashes": self.num_hashes,
+            "memory_bytes": len(self._bits), "estimated_fp_rate": fill ** self.num_hashes
+        }
+
+
+username_filter = None
+_username_filter_loading = None
+_username_filter_synced_to = None
+
+
+async def load_username_filter_async():
+    """Rebuild the username filter by streaming every account name."""
+    global username_filter, _username_filter_loading, _username_filter_synced_to
+    try:
+        total = await accounts_collection.estimated_document_count()
+        bloom = BloomFilter.for_capacity(
+            max(total * 2, config.USERNAME_FILTER_MIN_CAPACITY),
+            config.USERNAME_FILTER_FP_RATE, config.USERNAME_FILTER_MAX_BYTES)
+        _username_filter_loading = bloom
+        synced_to = None
+        async for account in accounts_collection.find({}, {"Username": 1}):
+            if account.get("Username"):
+                bloom.add(account["Username"])
+            synced_to = _newest_object_id(synced_to, account["_id"])
+        username_filter, _username_filter_synced_to = bloom, synced_to
+        return bloom.stats()
+    except Exception as e:
+        print(f"Error loading username filter: {e}")
+        return None
+    finally:
+        _username_filter_loading = None
+
+
+async def sync_username_filter_async():
+    """Add accounts created since the last sync; rebuild only to resize."""
+    global _username_filter_synced_to
+    bloom = username_filter
+    if bloom is None or (bloom.count > bloom.capacity
+                         and bloom.num_bits < config.USERNAME_FILTER_MAX_BYTES * 8):
+        return await load_username_filter_async()
+    try:
+        query = {}
+        if _username_filter_synced_to is not None:
+            since = _username_filter_synced_to.generation_time - datetime.timedelta(
+                seconds=config.USERNAME_FILTER_SYNC_OVERLAP_SECONDS)
+            query = {"_id": {"$gte": ObjectId.from_datetime(since)}}
+        async for account in accounts_collection.find(query, {"Username": 1}):
+            # The overlap re-reads recent names; skipping them keeps count accurate.
+            if account.get("Username") and account["Username"] not in bloom:
+                bloom.add(account["Username"])
+            _username_filter_synced_to = _newest_object_id(
+                _username_filter_synced_to, account["_id"])
+        return bloom.stats()
+    except Exception as e:
+        print(f"Error syncing username filter: {e}")
+        return None
+
+
+def _newest_object_id(current, candidate):
+    if not isinstance(candidate, ObjectId):
+        return current
+    return candidate if current is None or candidate > current else current
+
+
+def get_username_filter_stats():
+    return username_filter.stats() if username_filter else None
+
+
 # --- User Services ---
 
 
-async def check_user_async(username: str) -> bool:
+async def check_user_async(username: str, authoritative: bool = False) -> bool:
+    # A filter miss is a definite "available"; only possible hits reach Mongo.
+    if not authoritative and username_filter is not None and username not in username_filter:
+        return False
     try:
         return await accounts_collection.find_one({"Username": username}) is not None
     except Exception as e:
@@ -28,11 +241,16 @@ async def create_user_async(image: str, name: str, username: str, password: str,
             "Password": hashed_password, "Contact": mobile
         }
         await accounts_collection.insert_one(user)
-        return True, "User created successfully."
     except Exception as e:
         print(f"Error while creating user: {e}")
         return False, "An error occurred while creating the user."
 
+    # Outside the try: the insert is committed whatever happens here.
+    for bloom in (username_filter, _username_filter_loading):
+        if bloom is not None:
+            bloom.add(username)
+    return True, "User created successfully."
+
 
 async def validate_user_async(username: str, password: str) -> bool:
     try:
@@ -45,6 +263,7 @@ async def validate_user_async(username: str, password: str) -> bool:
         return False
 
 
+@coalesced
 async def get_user_profile_async(username: str):
     try:
         return await accounts_collection.find_one({"Username": username})
@@ -53,6 +272,7 @@ async def get_user_profile_async(username: str):
         return None
 
 
+@invalidates_reads
 async def update_user_async(username: str, image: str, name: str, mobile: str):
     try:
         update_fields = {"Name": name}
@@ -68,9 +288,15 @@ async def update_user_async(username: str, image: str, name: str, mobile: str):
 
 
 # --- Contact Services ---
+
+# Index-only fields kept off API responses
+HIDDEN_CONTACT_FIELDS = {"Contacts.NormalizedContact": 0}
+
+
+@coalesced
 async def get_contacts_async(username: str):
     try:
-        user_contacts = await user_contacts_collection.find_one({"Username": username})
+        user_contacts = await user_contacts_collection.find_one({"Username": username}, HIDDEN_CONTACT_FIELDS)
         return user_contacts.get("Contacts", []) if user_contacts else []
     except Exception as e:
         print(f"Error getting contacts: {e}")
@@ -80,7 +306,7 @@ async def get_contacts_async(username: str):
 async def get_contact_by_id_async(username: str, contact_id: str):
     try:
         obj_id = ObjectId(contact_id)
-        user_contacts = await user_contacts_collection.find_one({"Username": username})
+        user_contacts = await user_contacts_collection.find_one({"Username": username}, HIDDEN_CONTACT_FIELDS)
         if user_contacts:
             for contact in user_contacts.get("Contacts", []):
                 if contact.get("_id") == obj_id:
@@ -91,12 +317,13 @@ async def get_contact_by_id_async(username: str, contact_id: str):
         return None
 
 
+@invalidates_reads
 async def add_contact_async(username, image, name, mobile, email, job_title, company, labels, dt):
     try:
         new_contact = {
             "_id": ObjectId(), "Photo": image, "Name": name, "Contact": mobile,
-            "Email": email, "Job": job_title, "Company": company,
-            "Labels": labels, "DateTime": dt
+            "NormalizedContact": normalize_phone(mobile), "Email": email,
+            "Job": job_title, "Company": company, "Labels": labels, "DateTime": dt
         }
         await user_contacts_collection.update_one(
             {"Username": username},
@@ -109,11 +336,13 @@ async def add_contact_async(username, image, name, mobile, email, job_title, com
         return False, "An error occurred while adding the contact.", None
 
 
+@invalidates_reads
 async def update_contact_async(username, contact_id, new_name, mobile, email, job_title, company, labels):
     try:
         obj_id = ObjectId(contact_id)
         update_fields = {
-            "Contacts.$.Name": new_name, "Contacts.$.Contact": mobile, "Contacts.$.Email": email,
+            "Contacts.$.Name": new_name, "Contacts.$.Contact": mobile,
+            "Contacts.$.NormalizedContact": normalize_phone(mobile), "Contacts.$.Email": email,
             "Contacts.$.Job": job_title, "Contacts.$.Company": company, "Contacts.$.Labels": labels
         }
         result = await user_contacts_collection.update_one(
@@ -125,6 +354,7 @@ async def update_contact_async(username, contact_id, new_name, mobile, email, jo
         return False, "An error occurred while updating the contact."
 
 
+@invalidates_reads
 async def move_to_trash_async(username: str, contact_id: str):
     try:
         obj_id = ObjectId(contact_id)
@@ -152,6 +382,7 @@ async def move_to_trash_async(username: str, contact_id: str):
         return False, "An error occurred while moving the contact to trash."
 
 
+@invalidates_reads
 async def merge_contacts_async(username: str, contact_ids: list):
     if not isinstance(contact_ids, list) or len(contact_ids) < 2:
         return False, "A list of at least two contact IDs is required to merge.", None
@@ -197,6 +428,7 @@ async def merge_contacts_async(username: str, contact_ids: list):
         )
         if new_contact and '_id' in new_contact:
             new_contact['_id'] = str(new_contact['_id'])
+            new_contact.pop("NormalizedContact", None)
         return True, "Contacts merged successfully.", new_contact
     else:
         return False, message, None
@@ -211,13 +443,63 @@ async def search_contacts_async(username: str, query: str):
         print(f"Error searching contacts: {e}")
         return []
 
+
+async def lookup_contacts_by_phone_async(username: str, phones: list):
+    normalized = {phone: normalize_phone(phone) for phone in phones}
+    targets = list({n for n in normalized.values() if n})
+    matches = {n: [] for n in targets}
+    try:
+        if targets:
+            pipeline = [
+                {"$match": {"Username": username,
+                            "Contacts.NormalizedContact": {"$in": targets}}},
+                {"$project": {"_id": 0, "Contacts": {"$filter": {
+                    "input": "$Contacts", "as": "c",
+                    "cond": {"$in": ["$$c.NormalizedContact", targets]}
+                }}}}
+            ]
+            async for doc in user_contacts_collection.aggregate(pipeline):
+                for contact in doc.get("Contacts", []):
+                    matches[contact.pop("NormalizedContact")].append(contact)
+    except Exception as e:
+        print(f"Error looking up contacts by phone: {e}")
+    return {phone: {"normalized": n, "contacts": matches.get(n, [])} for phone, n in normalized.items()}
+
+
+async def backfill_normalized_contacts_async():
+    """Populate NormalizedContact on contacts saved before the field existed."""
+    try:
+        updated = 0
+        cursor = user_contacts_collection.find(
+            {"Contacts": {"$elemMatch": {"NormalizedContact": {"$exists": False}}}},
+            {"Contacts._id": 1, "Contacts.Contact": 1, "Contacts.NormalizedContact": 1})
+        async for doc in cursor:
+            missing = [c for c in doc.get("Contacts", [])
+                       if "NormalizedContact" not in c and "_id" in c]
+            if not missing:
+                continue
+            # Set only the missing field per element so concurrent edits survive.
+            await user_contacts_collection.bulk_write([
+                UpdateOne(
+                    {"_id": doc["_id"], "Contacts": {"$elemMatch": {
+                        "_id": contact["_id"], "NormalizedContact": {"$exists": False}}}},
+                    {"$set": {"Contacts.$.NormalizedContact": normalize_phone(contact.get("Contact"))}})
+                for contact in missing
+            ], ordered=False)
+            updated += 1
+        return updated
+    except Exception as e:
+        print(f"Error backfilling normalized contacts: {e}")
+        return 0
+
 # --- Trash Services ---
 
 
 async def get_trashed_contacts_async(username: str):
     try:
         trashed_docs = []
-        async for doc in trash_collection.find({"Username": username}).sort("deleted_at", -1):
+        async for doc in trash_collection.find(
+                {"Username": username}, {"ContactDetails.NormalizedContact": 0}).sort("deleted_at", -1):
             doc['_id'] = str(doc['_id'])
             doc['contact_id'] = str(doc['contact_id'])
             if 'ContactDetails' in doc and '_id' in doc['ContactDetails']:
@@ -230,6 +512,7 @@ async def get_trashed_contacts_async(username: str):
         return []
 
 
+@invalidates_reads
 async def restore_contact_async(username, contact_id):
     try:
         obj_id = ObjectId(contact_id)
@@ -237,9 +520,10 @@ async def restore_contact_async(username, contact_id):
         if not trashed_item:
             return False, "Contact not found in trash."
 
+        contact = trashed_item['ContactDetails']
+        contact["NormalizedContact"] = normalize_phone(contact.get("Contact"))
         await user_contacts_collection.update_one(
-            {"Username": username}, {
-                "$push": {"Contacts": trashed_item['ContactDetails']}}
+            {"Username": username}, {"$push": {"Contacts": contact}}
         )
         return True, "Contact restored successfully."
     except Exception as e:
@@ -268,6 +552,7 @@ async def empty_trash_async(username: str):
 # --- Label Services ---
 
 
+@invalidates_reads
 async def create_label_async(username: str, label_name: str):
     try:
         await labels_collection.insert_one({"Username": username, "LabelName": label_name})
@@ -277,6 +562,7 @@ async def create_label_async(username: str, label_name: str):
         return False, "An error occurred while creating the label."
 
 
+@coalesced
 async def get_labels_async(username: str):
     try:
         cursor = labels_collection.find({"Username": username})
@@ -286,6 +572,7 @@ async def get_labels_async(username: str):
         return []
 
 
+@invalidates_reads
 async def delete_label_async(username: str, label_name: str):
     try:
         result = await labels_collection.delete_one({"Username": username, "LabelName": label_name})
@@ -295,6 +582,7 @@ async def delete_label_async(username: str, label_name: str):
         return False, "An error occurred while deleting the label."
 
 
+@invalidates_reads
 async def edit_the_label_async(username: str, old_label_name: str, new_label_name: str):
     try:
         result = await labels_collection.update_one(